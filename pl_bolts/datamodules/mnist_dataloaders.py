@@ -1,3 +1,4 @@
+import torch
 from torch.utils.data import DataLoader, random_split
 from torchvision import transforms as transform_lib
 from torchvision.datasets import MNIST
@@ -5,14 +6,46 @@ from torchvision.datasets import MNIST
 from pl_bolts.datamodules.bolts_dataloaders_base import BoltDataLoaders
 
 
+class UInt8MNIST(MNIST):
+    """
+    MNIST variant that returns the raw uint8 image tensor instead of a
+    float one. uint8 batches cross the host->device link at a quarter of
+    the bytes of ToTensor's fp32 output; the model casts to float and
+    rescales once the batch is on the device.
+
+    Any transform passed in is applied to the uint8 tensor, not a PIL
+    image, so PIL-only transforms do not belong on this dataset.
+    """
+
+    def __getitem__(self, idx):
+        # self.data is already a uint8 tensor, just add the channel dim
+        img, target = self.data[idx].unsqueeze(0), int(self.targets[idx])
+
+        # transforms still apply, but to the uint8 tensor rather than PIL
+        if self.transform is not None:
+            img = self.transform(img)
+        if self.target_transform is not None:
+            target = self.target_transform(target)
+
+        return img, target
+
+
 class MNISTDataLoaders(BoltDataLoaders):
 
-    def __init__(self, save_path, val_split=5000, num_workers=16):
+    def __init__(self, save_path, val_split=5000, num_workers=16, uint8=False):
         super().__init__()
         self.save_path = save_path
         self.val_split = val_split
         self.num_workers = num_workers
 
+        # ship raw uint8 images and let the model normalize on device
+        self.uint8 = uint8
+        self.dataset_cls = UInt8MNIST if uint8 else MNIST
+
+        # seed the train/val split so every call (and every consumer) sees
+        # the same disjoint subsets
+        self.split_seed = 42
+
     @property
     def num_classes(self):
         return 10
@@ -25,16 +58,21 @@ class MNISTDataLoaders(BoltDataLoaders):
         if transforms is None:
             transforms = self._default_transforms()
 
-        dataset = MNIST(self.save_path, train=True, download=False, transform=transforms)
+        dataset = self.dataset_cls(self.save_path, train=True, download=False, transform=transforms)
         train_length = len(dataset)
-        dataset_train, _ = random_split(dataset, [train_length - self.val_split, self.val_split])
+        dataset_train, _ = random_split(
+            dataset,
+            [train_length - self.val_split, self.val_split],
+            generator=torch.Generator().manual_seed(self.split_seed)
+        )
         loader = DataLoader(
             dataset_train,
             batch_size=batch_size,
             shuffle=True,
             num_workers=self.num_workers,
             drop_last=True,
-            pin_memory=True
+            pin_memory=True,
+            persistent_workers=self.num_workers > 0
         )
         return loader
 
@@ -42,16 +80,21 @@ class MNISTDataLoaders(BoltDataLoaders):
         if transforms is None:
             transforms = self._default_transforms()
 
-        dataset = MNIST(self.save_path, train=True, download=True, transform=transforms)
+        dataset = self.dataset_cls(self.save_path, train=True, download=True, transform=transforms)
         train_length = len(dataset)
-        _, dataset_val = random_split(dataset, [train_length - self.val_split, self.val_split])
+        _, dataset_val = random_split(
+            dataset,
+            [train_length - self.val_split, self.val_split],
+            generator=torch.Generator().manual_seed(self.split_seed)
+        )
         loader = DataLoader(
             dataset_val,
             batch_size=batch_size,
             shuffle=False,
             num_workers=self.num_workers,
             drop_last=True,
-            pin_memory=True
+            pin_memory=True,
+            persistent_workers=self.num_workers > 0
         )
         return loader
 
@@ -59,18 +102,23 @@ class MNISTDataLoaders(BoltDataLoaders):
         if transforms is None:
             transforms = self._default_transforms()
 
-        dataset = MNIST(self.save_path, train=False, download=False, transform=transforms)
+        dataset = self.dataset_cls(self.save_path, train=False, download=False, transform=transforms)
         loader = DataLoader(
             dataset,
             batch_size=batch_size,
             shuffle=False,
             num_workers=self.num_workers,
             drop_last=True,
-            pin_memory=True
+            pin_memory=True,
+            persistent_workers=self.num_workers > 0
         )
         return loader
 
     def _default_transforms(self):
+        if self.uint8:
+            # UInt8MNIST bypasses PIL and returns tensors directly
+            return None
+
         mnist_transforms = transform_lib.Compose([
             transform_lib.ToTensor()
         ])
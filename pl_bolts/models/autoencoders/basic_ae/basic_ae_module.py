@@ -49,7 +49,9 @@ class BasicAE(LightningModule):
     def _run_step(self, batch):
         x, _ = batch
         z = self.encoder(x)
-        x_hat = self(z)
+
+        # the shared decoder returns logits
+        x_hat = torch.sigmoid(self(z))
 
         loss = F.mse_loss(x.view(x.size(0), -1), x_hat)
         return loss
@@ -1,15 +1,90 @@
 import os
 from argparse import ArgumentParser
+from typing import Tuple
 
 import torch
 from pytorch_lightning import LightningModule, Trainer
-from torch import distributions
+from torch import Tensor
 from torch.nn import functional as F
 
-from pl_bolts.datamodules import MNISTDataLoaders
+from pl_bolts.datamodules.mnist_dataloaders import MNISTDataLoaders, UInt8MNIST
 from pl_bolts.models.autoencoders.basic_vae.components import Encoder, Decoder
 
 
+class InMemoryLoader:
+    """
+    Minimal DataLoader stand-in that serves batches from tensors held
+    resident in memory (on the gpu when one is available).
+
+    There are no workers, no collate and no per-batch host->device copy:
+    each batch is a single on-device index into the resident tensors.
+    Batches are always full so downstream compiled graphs see one shape.
+    """
+
+    def __init__(self, x, y, batch_size, shuffle=True):
+        self.x = x
+        self.y = y
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+
+    def __len__(self):
+        return self.x.size(0) // self.batch_size
+
+    def __iter__(self):
+        # permute the full dataset first, then truncate, so a different
+        # random remainder is dropped each epoch (like DataLoader with
+        # drop_last=True) instead of a fixed tail never being trained on
+        num_samples = len(self) * self.batch_size
+        if self.shuffle:
+            perm = torch.randperm(self.x.size(0), device=self.x.device)[:num_samples]
+        else:
+            perm = torch.arange(self.x.size(0), device=self.x.device)[:num_samples]
+
+        for i in range(0, num_samples, self.batch_size):
+            idx = perm[i:i + self.batch_size]
+            yield self.x[idx], self.y[idx]
+
+
+@torch.jit.script
+def reparameterize(z_mu: Tensor, z_log_var: Tensor, eps: Tensor) -> Tensor:
+    """
+    Samples z = mu + sigma * eps with sigma = exp(0.5 * log_var).
+
+    Scripted so the mul/exp/mul/add chain runs as one fused pointwise
+    kernel instead of a separate launch per op.
+    """
+    sigma = torch.exp(0.5 * z_log_var)
+    return z_mu + sigma * eps
+
+
+@torch.jit.script
+def elbo(x: Tensor, pxz: Tensor, z_mu: Tensor, z_log_var: Tensor) -> Tuple[Tensor, Tensor, Tensor]:
+    """
+    ELBO loss for a Gaussian posterior/prior VAE.
+
+    Scripted so the JIT fuser can merge the pointwise BCE/KL math into a
+    single kernel instead of dispatching each op from python.
+    """
+    # Reconstruction loss
+    # the decoder outputs logits so we can use the numerically stable
+    # (and amp-safe) with_logits version of the BCE
+    recon_loss = F.binary_cross_entropy_with_logits(pxz, x, reduction='none')
+
+    # sum across dimensions because sum of log probabilities of iid univariate gaussians is the same as
+    # multivariate gaussian
+    recon_loss = recon_loss.sum(dim=-1)
+
+    # KL divergence loss
+    # closed form for KL(N(mu, sigma) || N(0, 1)), no Normal objects or
+    # log_prob passes needed
+    kl_div = 0.5 * (z_mu * z_mu + z_log_var.exp() - 1.0 - z_log_var).sum(dim=1)
+
+    # ELBO = reconstruction + KL, averaged over the batch
+    loss = (recon_loss + kl_div).mean()
+
+    return loss, recon_loss.mean(), kl_div.mean()
+
+
 class BasicVAE(LightningModule):
 
     def __init__(
@@ -21,13 +96,19 @@ class BasicVAE(LightningModule):
         self.__check_hparams(hparams)
         self.hparams = hparams
 
-        self.dataloaders = MNISTDataLoaders(save_path=os.getcwd())
+        # uint8 batches move 4x fewer bytes host->device; _run_step rescales
+        self.dataloaders = MNISTDataLoaders(save_path=os.getcwd(), uint8=True)
 
         self.encoder = self.init_encoder(self.hidden_dim, self.latent_dim,
                                          self.input_width, self.input_height)
         self.decoder = self.init_decoder(self.hidden_dim, self.latent_dim,
                                          self.input_width, self.input_height)
 
+        # noise buffer for the reparameterization trick, refilled in place
+        # every step instead of allocating a fresh randn_like. Non-persistent:
+        # it is pure scratch and has no place in checkpoints
+        self.register_buffer('eps', torch.empty(self.batch_size, self.latent_dim), persistent=False)
+
     def __check_hparams(self, hparams):
         self.hidden_dim = hparams.hidden_dim if hasattr(hparams, 'hidden_dim') else 128
         self.latent_dim = hparams.latent_dim if hasattr(hparams, 'latent_dim') else 32
@@ -37,131 +118,141 @@ class BasicVAE(LightningModule):
 
     def init_encoder(self, hidden_dim, latent_dim, input_width, input_height):
         encoder = Encoder(hidden_dim, latent_dim, input_width, input_height)
+
+        # MNIST shapes are static, so reduce-overhead (cuda graphs) pays off.
+        # no-op on PyTorch < 2.0 and the result is still an nn.Module
+        if hasattr(torch, 'compile'):
+            encoder = torch.compile(encoder, mode='reduce-overhead', fullgraph=False)
         return encoder
 
     def init_decoder(self, hidden_dim, latent_dim, input_width, input_height):
         decoder = Decoder(hidden_dim, latent_dim, input_width, input_height)
-        return decoder
-
-    def get_prior(self, z_mu, z_std):
-        # Prior ~ Normal(0,1)
-        P = distributions.normal.Normal(loc=torch.zeros_like(z_mu), scale=torch.ones_like(z_std))
-        return P
-
-    def get_approx_posterior(self, z_mu, z_std):
-        # Approx Posterior ~ Normal(mu, sigma)
-        Q = distributions.normal.Normal(loc=z_mu, scale=z_std)
-        return Q
-
-    def elbo_loss(self, x, P, Q):
-        # Reconstruction loss
-        z = Q.rsample()
-        pxz = self(z)
-        recon_loss = F.binary_cross_entropy(pxz, x, reduction='none')
 
-        # sum across dimensions because sum of log probabilities of iid univariate gaussians is the same as
-        # multivariate gaussian
-        recon_loss = recon_loss.sum(dim=-1)
-
-        # KL divergence loss
-        log_qz = Q.log_prob(z)
-        log_pz = P.log_prob(z)
-        kl_div = (log_qz - log_pz).sum(dim=1)
-
-        # ELBO = reconstruction + KL
-        loss = recon_loss + kl_div
-
-        # average over batch
-        loss = loss.mean()
-        recon_loss = recon_loss.mean()
-        kl_div = kl_div.mean()
-
-        return loss, recon_loss, kl_div, pxz
+        if hasattr(torch, 'compile'):
+            decoder = torch.compile(decoder, mode='reduce-overhead', fullgraph=False)
+        return decoder
 
     def forward(self, z):
         return self.decoder(z)
 
     def _run_step(self, batch):
         x, _ = batch
+
+        # the loaders ship raw uint8 images; convert to pixels in [0, 1] only
+        # once the batch is on the device
+        if x.dtype == torch.uint8:
+            x = x.float().mul_(1.0 / 255.0)
+
+        # transforms can hand back non-contiguous tensors, which slows the conv
+        # encoder on cuda. A single contiguous() up front (a no-op when the
+        # layout is already dense) keeps memory access coalesced and makes the
+        # flatten for the loss below a free view
+        x = x.contiguous()
+
         z_mu, z_log_var = self.encoder(x)
-        z_std = torch.exp(z_log_var / 2)
 
-        P = self.get_prior(z_mu, z_std)
-        Q = self.get_approx_posterior(z_mu, z_std)
+        # reparameterization trick, reusing the cached noise buffer
+        eps = self.eps[:z_mu.size(0)].normal_()
+        z = reparameterize(z_mu, z_log_var, eps)
+        pxz = self(z)
 
-        x = x.view(x.size(0), -1)
+        # flatten to match the decoder's output for the loss
+        x = x.flatten(1)
 
-        loss, recon_loss, kl_div, pxz = self.elbo_loss(x, P, Q)
+        loss, recon_loss, kl_div = elbo(x, pxz, z_mu, z_log_var)
 
         return loss, recon_loss, kl_div, pxz
 
+    def on_train_start(self):
+        # run one dummy forward/backward at the canonical batch size so
+        # torch.compile and the scripted kernels specialize here instead of
+        # stalling on the first real step
+        x = torch.zeros(self.batch_size, 1, self.input_width, self.input_height, device=self.device)
+
+        # snapshot the batchnorm running stats so the blank warmup batch
+        # does not pollute eval-mode numerics
+        bn_layers = [m for m in self.modules() if isinstance(m, torch.nn.BatchNorm1d)]
+        bn_state = [(m.running_mean.clone(), m.running_var.clone(), m.num_batches_tracked.clone())
+                    for m in bn_layers]
+
+        # match the trainer's precision so the warmup specializes the same
+        # graphs the real (autocast) steps will run
+        use_amp = str(getattr(self.trainer, 'precision', 32)).startswith('16') and torch.cuda.is_available()
+        with torch.cuda.amp.autocast(enabled=use_amp):
+            loss, _, _, _ = self._run_step((x, None))
+        loss.backward()
+        self.zero_grad(set_to_none=True)
+
+        for layer, (mean, var, tracked) in zip(bn_layers, bn_state):
+            layer.running_mean.copy_(mean)
+            layer.running_var.copy_(var)
+            layer.num_batches_tracked.copy_(tracked)
+
     def training_step(self, batch, batch_idx):
         loss, recon_loss, kl_div, pxz = self._run_step(batch)
 
-        tensorboard_logs = {
-            'train_elbo_loss': loss,
-            'train_recon_loss': recon_loss,
-            'train_kl_loss': kl_div
-        }
+        # log directly instead of building a tensorboard dict per step
+        self.log('train_elbo_loss', loss, on_step=True, on_epoch=False)
+        self.log('train_recon_loss', recon_loss, on_step=True, on_epoch=False)
+        self.log('train_kl_loss', kl_div, on_step=True, on_epoch=False)
 
-        return {'loss': loss, 'log': tensorboard_logs}
+        return loss
 
     def validation_step(self, batch, batch_idx):
         loss, recon_loss, kl_div, pxz = self._run_step(batch)
 
-        return {
-            'val_loss': loss,
+        # averaged over the epoch by self.log, so no epoch_end hook is needed.
+        # pxz is not returned since nothing consumes it downstream
+        self.log_dict({
+            'val_elbo_loss': loss,
             'val_recon_loss': recon_loss,
-            'val_kl_div': kl_div,
-            'pxz': pxz
-        }
-
-    def validation_epoch_end(self, outputs):
-        avg_loss = torch.stack([x['val_loss'] for x in outputs]).mean()
-        recon_loss = torch.stack([x['val_recon_loss'] for x in outputs]).mean()
-        kl_loss = torch.stack([x['val_kl_div'] for x in outputs]).mean()
-
-        tensorboard_logs = {'val_elbo_loss': avg_loss,
-                            'val_recon_loss': recon_loss,
-                            'val_kl_loss': kl_loss}
-
-        return {
-            'avg_val_loss': avg_loss,
-            'log': tensorboard_logs
-        }
+            'val_kl_loss': kl_div
+        })
 
     def test_step(self, batch, batch_idx):
         loss, recon_loss, kl_div, pxz = self._run_step(batch)
 
-        return {
-            'test_loss': loss,
+        self.log_dict({
+            'test_elbo_loss': loss,
             'test_recon_loss': recon_loss,
-            'test_kl_div': kl_div,
-            'pxz': pxz
-        }
-
-    def test_epoch_end(self, outputs):
-        avg_loss = torch.stack([x['test_loss'] for x in outputs]).mean()
-        recon_loss = torch.stack([x['test_recon_loss'] for x in outputs]).mean()
-        kl_loss = torch.stack([x['test_kl_div'] for x in outputs]).mean()
-
-        tensorboard_logs = {'test_elbo_loss': avg_loss,
-                            'test_recon_loss': recon_loss,
-                            'test_kl_loss': kl_loss}
-
-        return {
-            'avg_test_loss': avg_loss,
-            'log': tensorboard_logs
-        }
+            'test_kl_loss': kl_div
+        })
 
     def configure_optimizers(self):
         return torch.optim.Adam(self.parameters(), lr=0.001)
 
+    def optimizer_zero_grad(self, epoch, batch_idx, optimizer, optimizer_idx):
+        # freeing the grads instead of writing zeros skips a full pass over
+        # the parameter memory every step
+        optimizer.zero_grad(set_to_none=True)
+
     def prepare_data(self):
         self.dataloaders.prepare_data()
 
+    def setup(self, stage=None):
+        # prepare_data only runs on rank 0 and must not set state, so the
+        # resident copy is staged here, once per process
+        if stage == 'test' or getattr(self, '_train_x', None) is not None:
+            return
+
+        # the full MNIST train split is ~47MB as uint8, so keep it resident
+        # (on the gpu when available) and delete the DataLoader from the
+        # training hot path entirely
+        dataset = UInt8MNIST(os.getcwd(), train=True, download=False)
+        device = 'cuda' if torch.cuda.is_available() else 'cpu'
+
+        # mirror the seeded split in MNISTDataLoaders (random_split hands the
+        # first chunk of the permutation to train) so the resident train set
+        # stays disjoint from the val loader's samples
+        generator = torch.Generator().manual_seed(self.dataloaders.split_seed)
+        perm = torch.randperm(len(dataset), generator=generator)
+        train_idx = perm[:len(dataset) - self.dataloaders.val_split]
+
+        self._train_x = dataset.data[train_idx].unsqueeze(1).to(device)
+        self._train_y = dataset.targets[train_idx].to(device)
+
     def train_dataloader(self):
-        return self.dataloaders.train_dataloader(self.batch_size)
+        return InMemoryLoader(self._train_x, self._train_y, self.batch_size)
 
     def val_dataloader(self):
         return self.dataloaders.val_dataloader(self.batch_size)
@@ -188,8 +279,18 @@ if __name__ == '__main__':
     parser = ArgumentParser()
     parser = Trainer.add_argparse_args(parser)
     parser = BasicVAE.add_model_specific_args(parser)
+
+    # 16-bit runs the encoder/decoder GEMMs on tensor cores and halves
+    # activation memory (gpu only), benchmark=True lets cudnn pick the
+    # fastest conv algorithm for the fixed 28x28 shapes. set_defaults
+    # keeps every flag overridable from the CLI
+    parser.set_defaults(
+        precision=16 if torch.cuda.is_available() else 32,
+        benchmark=True,
+        gradient_clip_val=1.0
+    )
     args = parser.parse_args()
 
     vae = BasicVAE(args)
-    trainer = Trainer()
+    trainer = Trainer.from_argparse_args(args)
     trainer.fit(vae)
@@ -25,8 +25,9 @@ class Encoder(torch.nn.Module):
         self.fc1 = DenseBlock(conv_out_dim, hidden_dim)
         self.fc2 = DenseBlock(hidden_dim, hidden_dim)
 
-        self.mu_fc = nn.Linear(hidden_dim, latent_dim)
-        self.sigma_fc = nn.Linear(hidden_dim, latent_dim)
+        # single head for mu and sigma - one wider GEMM beats two narrow
+        # launches and has better tensor-core utilization
+        self.mu_sigma_fc = nn.Linear(hidden_dim, 2 * latent_dim)
 
     def _calculate_output_dim(self, input_width, input_height):
         x = torch.rand(1, 1, input_width, input_height)
@@ -38,16 +39,13 @@ class Encoder(torch.nn.Module):
         x = F.relu(self.c1(x))
         x = F.relu(self.c2(x))
         x = F.relu(self.c3(x))
-        x = x.view(x.size(0), -1)
+        x = x.flatten(1)
 
         x = self.fc1(x)
         x = self.fc2(x)
 
-        # generate mu
-        mu = self.mu_fc(x)
-
-        # generate sigma
-        sigma = self.sigma_fc(x)
+        # generate mu and sigma from the fused head
+        mu, sigma = self.mu_sigma_fc(x).chunk(2, dim=-1)
         return mu, sigma
 
 
@@ -86,8 +84,11 @@ class Decoder(torch.nn.Module):
         x = F.relu(self.dc1(x))
         x = F.relu(self.dc2(x))
         x = F.relu(self.dc3(x))
-        x = F.sigmoid(self.dc4(x))
-        x = x.view(x.size(0), -1)
+
+        # return logits so the loss can use the numerically stable (and amp-safe)
+        # binary_cross_entropy_with_logits. Apply sigmoid when pixels are needed.
+        x = self.dc4(x)
+        x = x.flatten(1)
         return x
 
 
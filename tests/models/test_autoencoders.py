@@ -11,7 +11,7 @@ def test_vae(tmpdir):
     trainer = pl.Trainer(fast_dev_run=True)
     trainer.fit(model)
     trainer.test()
-    loss = trainer.callback_metrics['loss']
+    loss = trainer.callback_metrics['train_elbo_loss']
 
     assert loss > 0, 'VAE failed'
 